@@ -2,6 +2,7 @@ from sqlalchemy.orm import Session
 from . import models
 
 from pathlib import Path
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from . import models
 from config import settings
@@ -19,9 +20,16 @@ def create_document(db: Session, *, filename: str, content_type: str, size: int,
     db.refresh(doc)
     return doc
 
-def add_result(db: Session, *, document_id: str, ocr_conf: float, tokens: int, cost: float, extracted: dict) -> models.Result:
+def update_stored_path(db: Session, doc: models.Document, stored_path: str) -> models.Document:
+    doc.stored_path = stored_path
+    db.commit()
+    db.refresh(doc)
+    return doc
+
+def add_result(db: Session, *, document_id: str, ocr_conf: float, tokens: int, cost: float, extracted: dict, document_type: str | None = None) -> models.Result:
     res = models.Result(
         document_id=document_id,
+        document_type=document_type,
         ocr_confidence=ocr_conf,
         tokens_used=tokens,
         api_cost=cost,
@@ -51,6 +59,23 @@ def list_recent(db: Session, limit: int = 10):
         .all()
     )
 
+def iter_results(db: Session, *, start=None, end=None, vendor: str | None = None, document_type: str | None = None, batch_size: int = 500):
+    """Stream (Result, Document) rows oldest-first, `batch_size` rows per DB fetch."""
+    q = (
+        db.query(models.Result, models.Document)
+        .join(models.Document, models.Result.document_id == models.Document.id)
+        .order_by(models.Result.created_at)
+    )
+    if start is not None:
+        q = q.filter(models.Result.created_at >= start)
+    if end is not None:
+        q = q.filter(models.Result.created_at < end)
+    if vendor:
+        q = q.filter(func.lower(models.Result.extracted_json["vendor"].as_string()) == vendor.lower())
+    if document_type:
+        q = q.filter(models.Result.document_type == document_type)
+    return q.execution_options(stream_results=True).yield_per(batch_size)
+
 def list_documents(db, limit=20):
     return db.query(models.Document).order_by(models.Document.created_at.desc()).limit(limit).all()
 
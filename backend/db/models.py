@@ -29,6 +29,7 @@ class Result(Base):
     ocr_confidence: Mapped[float] = mapped_column(Float)
     tokens_used: Mapped[int] = mapped_column(Integer, default=0)
     api_cost: Mapped[float] = mapped_column(Float, default=0.0)
+    document_type: Mapped[str | None] = mapped_column(String, nullable=True)
     extracted_json: Mapped[dict] = mapped_column(JSON)  # works in SQLite+Postgres
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
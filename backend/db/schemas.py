@@ -8,6 +8,7 @@ class ResultOut(BaseModel):
     ocr_confidence: float
     tokens_used: int
     api_cost: float
+    document_type: Optional[str] = None
     extracted_json: dict
     created_at: datetime
 
@@ -28,4 +29,5 @@ class DocumentOut(BaseModel):
 class ProcessResponse(BaseModel):
     document: DocumentOut
     latest_result: ResultOut
-    extracted_data: Optional[dict] = None
\ No newline at end of file
+    extracted_data: Optional[dict] = None
+    document_type: Optional[str] = None
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""Streaming bulk export of extraction results (NDJSON, CSV, Parquet).
+
+Every writer consumes rows from crud.iter_results() one DB batch at a time
+and yields encoded bytes as it goes, so memory stays flat regardless of how
+many rows are exported.
+"""
+import csv, io, json, zlib, logging
+from backend.db import crud
+from backend.db.database import SessionLocal
+from backend.pipeline.document_types import DOCUMENT_TYPES
+
+logger = logging.getLogger("smartdoc")
+
+BATCH_SIZE = 500
+BASE_COLUMNS = [
+    "document_id", "filename", "document_type", "document_created_at", "result_created_at",
+    "ocr_confidence", "tokens_used", "api_cost",
+]
+STRING_BASE_COLUMNS = BASE_COLUMNS[:5]
+# Union of every registered schema's fields, in registration order
+FIELD_COLUMNS = list(dict.fromkeys(k for t in DOCUMENT_TYPES.values() for k in t.expected_keys))
+
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _flat_row(res, doc) -> dict:
+    extracted = res.extracted_json or {}
+    row = {
+        "document_id": doc.id,
+        "filename": doc.filename,
+        "document_type": res.document_type,
+        "document_created_at": doc.created_at.isoformat() if doc.created_at else None,
+        "result_created_at": res.created_at.isoformat() if res.created_at else None,
+        "ocr_confidence": res.ocr_confidence,
+        "tokens_used": res.tokens_used,
+        "api_cost": res.api_cost,
+    }
+    for k in FIELD_COLUMNS:
+        v = extracted.get(k)
+        row[k] = None if v is None else str(v)
+    return row
+
+
+def _batches(filters: dict):
+    """Yield lists of flat rows, BATCH_SIZE at a time, from a private session.
+
+    The request's get_db session is closed once the endpoint returns, before
+    the response body is streamed, so the export owns its own session.
+    """
+    db = SessionLocal()
+    try:
+        batch = []
+        for res, doc in crud.iter_results(db, batch_size=BATCH_SIZE, **filters):
+            batch.append(_flat_row(res, doc))
+            if len(batch) >= BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        db.close()
+
+
+def _ndjson(filters: dict):
+    for batch in _batches(filters):
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in batch).encode("utf-8")
+
+
+def _csv(filters: dict):
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=BASE_COLUMNS + FIELD_COLUMNS)
+    writer.writeheader()
+    for batch in _batches(filters):
+        writer.writerows(batch)
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+class _Drain(io.RawIOBase):
+    """Write-only sink whose buffered bytes are handed out and dropped on take()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._pos += len(b)
+        return len(b)
+
+    def take(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def _parquet(filters: dict):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    columns = BASE_COLUMNS + FIELD_COLUMNS
+    schema = pa.schema(
+        [(c, pa.string()) for c in STRING_BASE_COLUMNS]
+        + [("ocr_confidence", pa.float64()), ("tokens_used", pa.int64()), ("api_cost", pa.float64())]
+        + [(c, pa.string()) for c in FIELD_COLUMNS]
+    )
+    sink = _Drain()
+    # One row group per DB batch; column chunks are gzip-compressed inside the file
+    with pq.ParquetWriter(sink, schema, compression="gzip") as writer:
+        for batch in _batches(filters):
+            table = pa.Table.from_pydict({c: [r[c] for r in batch] for c in columns}, schema=schema)
+            writer.write_table(table)
+            yield sink.take()
+    yield sink.take()  # footer
+
+
+def _gzip(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 → gzip container
+    for chunk in chunks:
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
+def stream_results(fmt: str, *, compress: bool = True, **filters):
+    """Return an iterator of encoded bytes for `fmt` ("ndjson", "csv" or "parquet").
+
+    Text formats are gzipped on the fly when `compress` is set; Parquet is
+    compressed internally instead.
+    """
+    writers = {"ndjson": _ndjson, "csv": _csv, "parquet": _parquet}
+    logger.info(f"Starting {fmt} export | filters={filters}")
+    chunks = writers[fmt](filters)
+    if compress and fmt != "parquet":
+        chunks = _gzip(chunks)
+    return chunks
@@ -1,8 +1,8 @@
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
-import shutil, os, logging, time
-from logging.handlers import RotatingFileHandler
+import shutil, os, logging, tempfile, time
+from logging.handlers import RotatingFileHandler, WatchedFileHandler
 from prometheus_fastapi_instrumentator import Instrumentator
 from prometheus_client import Counter, Histogram, Gauge
 
@@ -11,14 +11,22 @@ BASE_DIR = Path(__file__).resolve().parents[1]
 LOGS_DIR = BASE_DIR / "logs"
 LOGS_DIR.mkdir(parents=True, exist_ok=True)
 
-file_handler = RotatingFileHandler(
-    LOGS_DIR / "app.log",
-    maxBytes=5_000_000,
-    backupCount=3,
-    encoding="utf-8",
-)
+# load config from project root (your current setup)
+from config import settings
+
+if settings.web_concurrency > 1:
+    # Several workers append to one file: rotating from inside a worker would
+    # race the others, so only append here and leave rotation to logrotate.
+    file_handler = WatchedFileHandler(LOGS_DIR / "app.log", encoding="utf-8")
+else:
+    file_handler = RotatingFileHandler(
+        LOGS_DIR / "app.log",
+        maxBytes=5_000_000,
+        backupCount=3,
+        encoding="utf-8",
+    )
 formatter = logging.Formatter(
-    "%(asctime)s | %(levelname)s | %(name)s | %(message)s", "%Y-%m-%d %H:%M:%S"
+    "%(asctime)s | %(levelname)s | %(process)d | %(name)s | %(message)s", "%Y-%m-%d %H:%M:%S"
 )
 file_handler.setFormatter(formatter)
 
@@ -37,9 +45,6 @@ smart_logger.propagate = False
 smart_logger.info("SmartDoc logger configured. Logs dir: %s", LOGS_DIR)
 # ---- end logging setup ----
 
-# load config from project root (your current setup)
-from config import settings
-
 app = FastAPI(title="SmartDoc API")
 api_log = logging.getLogger("smartdoc")
 
@@ -82,9 +87,62 @@ processing_duration = Histogram(
     buckets=[1.0, 5.0, 10.0, 30.0, 60.0, 120.0]
 )
 
+# Gauges declare how to combine per-worker values in multiprocess mode
 active_processing = Gauge(
     'smartdoc_active_processing',
-    'Number of documents currently being processed'
+    'Number of documents currently being processed',
+    multiprocess_mode='livesum'
+)
+
+ocr_cache_pages = Counter(
+    'smartdoc_ocr_cache_pages_total',
+    'Pages looked up in the OCR page cache',
+    ['result']  # hit_memory, hit_disk or miss
+)
+
+ocr_cache_seconds_saved = Counter(
+    'smartdoc_ocr_cache_cpu_seconds_saved_total',
+    'Tesseract time avoided by serving pages from the OCR cache'
+)
+
+queue_wait_duration = Histogram(
+    'smartdoc_queue_wait_seconds',
+    'Time a document waited in the scheduler before processing started',
+    ['lane'],
+    buckets=[0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0]
+)
+
+service_duration = Histogram(
+    'smartdoc_service_duration_seconds',
+    'Time from leaving the scheduler queue to finishing processing',
+    ['lane'],
+    buckets=[1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0]
+)
+
+document_cost = Histogram(
+    'smartdoc_document_cost_usd',
+    'LLM cost per document',
+    ['document_type', 'model'],
+    buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1]
+)
+
+document_type_duration = Histogram(
+    'smartdoc_document_type_processing_duration_seconds',
+    'Total document processing time by classified document type',
+    ['document_type'],
+    buckets=[1.0, 5.0, 10.0, 30.0, 60.0, 120.0]
+)
+
+memory_budget_in_use = Gauge(
+    'smartdoc_memory_budget_bytes_in_use',
+    'Bytes of the rasterization memory budget currently reserved',
+    multiprocess_mode='livesum'
+)
+
+memory_budget_peak = Gauge(
+    'smartdoc_memory_budget_peak_bytes',
+    'Highest rasterization memory budget reservation seen by any worker',
+    multiprocess_mode='max'
 )
 
 # ===== END PROMETHEUS SETUP =====
@@ -99,25 +157,67 @@ app.add_middleware(
 
 # ---- delayed imports to avoid circular/import-path surprises ----
 # DB wiring
-from backend.db.database import get_db, engine
+from backend.db.database import get_db, engine, add_missing_columns
 from backend.db import models as db_models
 from backend.db import crud, schemas
 
 # Processing pipeline
 from backend.pipeline.document_processor import DocumentProcessor
-from fastapi import Query
-from typing import List
+from backend.pipeline.cv_processor import CVProcessor
+from backend.pipeline.memory_budget import MemoryBudget, MemoryBudgetExceeded, default_budget_bytes
+from backend.pipeline.scheduler import Scheduler, estimate_cost
+from backend import export
+from fastapi import Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime, timedelta
+from typing import Literal
 
 # ----------------------------------------------------------------
 
 logger = logging.getLogger(__name__)
 
+_processor: DocumentProcessor | None = None
+_processor_pid: int | None = None
+
 def get_processor():
-    """Create processor only when needed (lazy initialization for GCP)"""
-    return DocumentProcessor()
+    """Create processor only when needed (lazy initialization for GCP).
 
-# Dev convenience: create tables once (use Alembic later in prod)
-db_models.Base.metadata.create_all(bind=engine)
+    One instance (and one LLM client) per worker process. Workers import the
+    app after fork, so the pid check only matters if the app is preloaded
+    (gunicorn --preload), where a worker could inherit its parent's client.
+    """
+    global _processor, _processor_pid
+    if _processor is None or _processor_pid != os.getpid():
+        _processor = DocumentProcessor()
+        _processor_pid = os.getpid()
+    return _processor
+
+# Shared by every request in this worker; the configured budget is split
+# evenly across workers so the container as a whole stays within it, but a
+# worker always gets room for the largest page we OCR, or ordinary uploads would
+# be refused outright.
+memory_budget_total = (
+    settings.memory_budget_mb * 1024 * 1024 if settings.memory_budget_mb else default_budget_bytes()
+)
+_page_bytes = CVProcessor().max_page_bytes()
+_worker_share = memory_budget_total // max(1, settings.web_concurrency)
+if _worker_share < _page_bytes:
+    smart_logger.warning(
+        f"Memory budget {memory_budget_total >> 20} MiB over {settings.web_concurrency} workers "
+        f"is under one page ({_page_bytes >> 20} MiB) per worker; use fewer workers or a larger budget"
+    )
+memory_budget = MemoryBudget(max(_worker_share, _page_bytes))
+memory_budget_in_use.set(0)
+
+# Orders OCR/LLM work within this worker: interactive before bulk, fair across clients
+scheduler = Scheduler(settings.scheduler_concurrency, settings.scheduler_lane_weights)
+
+# Dev convenience: create tables once (use Alembic later in prod). Under
+# gunicorn the master already did this in on_starting, before forking workers.
+if not os.getenv("SMARTDOC_SCHEMA_READY"):
+    db_models.Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
 
 # Instrument the app and expose /metrics endpoint
 # Must be called after app creation but before defining routes
@@ -125,6 +225,18 @@ instrumentator.instrument(app).expose(app)
 
 smart_logger.info("Prometheus instrumentation enabled. Metrics available at /metrics")
 
+
+@app.on_event("startup")
+def init_worker():
+    """Per-worker setup. Dropping inherited DB connections only matters when
+    the app is preloaded (gunicorn --preload); gunicorn.conf.py doesn't do
+    that, so each worker already starts with an empty pool."""
+    engine.dispose(close=False)
+    smart_logger.info(
+        f"Worker {os.getpid()} started ({settings.web_concurrency} worker(s), "
+        f"multiprocess metrics: {'PROMETHEUS_MULTIPROC_DIR' in os.environ})"
+    )
+
 # ===== ENDPOINTS =====
 
 @app.get("/health")
@@ -146,7 +258,7 @@ def get_document(doc_id: str, db=Depends(get_db)):
     res = crud.get_latest_result(db, doc_id)
     if not res:
         raise HTTPException(404, "No results for this document")
-    return {"document": doc, "latest_result": res}
+    return {"document": doc, "latest_result": res, "document_type": res.document_type}
 
 
 @app.post("/upload")
@@ -164,6 +276,7 @@ async def upload_document(file: UploadFile = File(...)):
 
 @app.post("/process", response_model=schemas.ProcessResponse)
 async def process_document(
+    request: Request,
     file: UploadFile = File(...), 
     db=Depends(get_db),
     processor: DocumentProcessor = Depends(get_processor)
@@ -171,14 +284,22 @@ async def process_document(
     """
     Full pipeline with Prometheus metrics:
       1) Save upload to disk
-      2) Create Document row
-      3) Run OCR + LLM
-      4) Persist Result row
-      5) Return (document, latest_result)
+      2) Wait for a scheduler slot in the document's lane
+      3) Reserve memory budget for rasterization (503 if it can't fit)
+      4) Create Document row
+      5) Run OCR + LLM
+      6) Persist Result row
+      7) Return (document, latest_result)
+
+    Documents over `interactive_max_pages` go to the bulk lane, as does
+    anything sent with `X-Priority: bulk`. The header can't raise priority.
     """
     # Start timing
     start_time = time.time()
     active_processing.inc()  # Increment active processing counter
+    reserved = 0
+    ticket = None
+    temp_path = None
     
     try:
         api_log.info("Received /process request")
@@ -186,12 +307,41 @@ async def process_document(
         # 1) Save upload
         upload_dir = Path(settings.upload_dir)
         upload_dir.mkdir(parents=True, exist_ok=True)
-        temp_path = upload_dir / file.filename
-        with open(temp_path, "wb") as buffer:
+        # Unique temp name: the handler awaits below, so same-named uploads can interleave
+        fd, tmp_name = tempfile.mkstemp(
+            dir=upload_dir, prefix=".upload-", suffix=Path(file.filename).suffix
+        )
+        temp_path = Path(tmp_name)
+        with os.fdopen(fd, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
         size = os.path.getsize(temp_path)
 
-        # 2) Create Document row (DB will assign id)
+        # 2) Scheduling: cost from size, type and page count; fair across clients
+        estimate = await run_in_threadpool(processor.cv.estimate_memory, temp_path)  # pdfinfo subprocess
+        lane = "bulk" if estimate["pages"] > settings.interactive_max_pages else "interactive"
+        if request.headers.get("X-Priority", "").lower() == "bulk":
+            lane = "bulk"  # clients may only downgrade themselves
+        client_id = request.headers.get(settings.client_id_header) or (
+            request.client.host if request.client else "anonymous"
+        )
+        cost = estimate_cost(temp_path.suffix, size, estimate["pages"])
+        ticket = await scheduler.acquire(lane, client_id, cost)
+        queue_wait_duration.labels(lane=lane).observe(ticket.started_at - ticket.enqueued_at)
+
+        # 3) Admission control: hold until the page working set fits the budget
+        try:
+            await run_in_threadpool(
+                memory_budget.acquire, estimate["bytes"], settings.memory_budget_wait_seconds
+            )
+        except MemoryBudgetExceeded as e:
+            documents_processed.labels(status='rejected').inc()
+            api_log.warning(f"Rejected {file.filename} ({estimate['pages']} page(s)): {e}")
+            raise HTTPException(status_code=503, detail=str(e))
+        reserved = estimate["bytes"]
+        memory_budget_in_use.set(memory_budget.in_use)
+        memory_budget_peak.set(memory_budget.peak)
+
+        # 4) Create Document row (DB will assign id)
         doc = crud.create_document(
             db,
             filename=file.filename,
@@ -205,13 +355,16 @@ async def process_document(
         doc_dir.mkdir(parents=True, exist_ok=True)
         final_path = doc_dir / file.filename
         temp_path.replace(final_path)
+        temp_path = None
+        doc = crud.update_stored_path(db, doc, str(final_path))
 
-        # 3) Run pipeline with timing
+        # 5) Run pipeline with timing (in a worker thread so the event loop stays free)
         llm_start = time.time()
-        result = processor.process(final_path)
+        result = await run_in_threadpool(processor.process, final_path)
         llm_duration = time.time() - llm_start
         
-        # Record LLM call duration
+        # Record LLM call duration (the pipeline times the API call itself)
+        llm_duration = float(result.get("llm_duration", llm_duration))
         llm_call_duration.observe(llm_duration)
 
         # Extract metrics safely
@@ -219,12 +372,21 @@ async def process_document(
         tokens = int(result.get("tokens_used", 0) or 0)
         cost = float(result.get("processing_cost", 0.0) or 0.0)
         extracted = result.get("extracted_data", {}) or {}
+        doc_type = result.get("document_type", "unknown")
 
         # Record OCR confidence if available
         if ocr_conf > 0:
             ocr_confidence.observe(ocr_conf)
 
-        # 4) Persist Result row
+        # Page-level OCR cache hit rate and time saved
+        ocr = result.get("ocr", {})
+        hits = ocr.get("cache_hits", {})
+        ocr_cache_pages.labels(result='hit_memory').inc(hits.get("memory", 0))
+        ocr_cache_pages.labels(result='hit_disk').inc(hits.get("disk", 0))
+        ocr_cache_pages.labels(result='miss').inc(ocr.get("cache_misses", 0))  # 0 when the cache is off
+        ocr_cache_seconds_saved.inc(ocr.get("ocr_seconds_saved", 0.0))
+
+        # 6) Persist Result row
         res = crud.add_result(
             db,
             document_id=doc.id,
@@ -232,6 +394,7 @@ async def process_document(
             tokens=tokens,
             cost=cost,
             extracted=extracted,
+            document_type=result.get("document_type"),
         )
 
         # Save processed JSON to disk
@@ -250,13 +413,18 @@ async def process_document(
         # Record total processing time
         total_duration = time.time() - start_time
         processing_duration.observe(total_duration)
+        document_type_duration.labels(document_type=doc_type).observe(total_duration)
+        document_cost.labels(document_type=doc_type, model=result.get("model", "unknown")).observe(cost)
         
         api_log.info(f"Document processed successfully in {total_duration:.2f}s (LLM: {llm_duration:.2f}s)")
 
-        # 5) Response
+        # 7) Response
         clean = result.get("extracted_data") or result.get("extracted_json") or {}
-        return {"document": doc, "latest_result": res, "extracted_data": clean}
-        
+        return {"document": doc, "latest_result": res, "extracted_data": clean, "document_type": doc_type}
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         # Record failed processing
         documents_processed.labels(status='failed').inc()
@@ -271,6 +439,15 @@ async def process_document(
     finally:
         # Always decrement active processing counter
         active_processing.dec()
+        if reserved:
+            memory_budget.release(reserved)
+            memory_budget_in_use.set(memory_budget.in_use)
+        # Upload never made it under its doc folder (rejected or failed early)
+        if temp_path is not None:
+            temp_path.unlink(missing_ok=True)
+        if ticket:
+            scheduler.release(ticket)
+            service_duration.labels(lane=ticket.lane).observe(time.monotonic() - ticket.started_at)
 
 
 @app.get("/results/{doc_id}", response_model=schemas.ProcessResponse)
@@ -281,7 +458,7 @@ async def get_result(doc_id: str, db=Depends(get_db)):
     res = crud.get_latest_result(db, doc_id)
     if not res:
         raise HTTPException(status_code=404, detail="No results for this document yet")
-    return {"document": doc, "latest_result": res}
+    return {"document": doc, "latest_result": res, "document_type": res.document_type}
 
 
 @app.get("/results")
@@ -294,11 +471,49 @@ async def list_results(limit: int = 10, db=Depends(get_db)):
         enriched.append({
             "document_id": row.document_id,
             "vendor": vendor,
+            "document_type": row.document_type,
             "created_at": row.created_at,
         })
     return enriched
 
 
+@app.get("/export")
+def export_results(
+    request: Request,
+    format: Literal["ndjson", "csv", "parquet"] = "ndjson",
+    start: date | None = None,
+    end: date | None = None,
+    vendor: str | None = None,
+    document_type: str | None = None,
+    gzip: bool = True,
+):
+    """
+    Stream every result (optionally filtered by date range [start, end],
+    vendor and document type) as NDJSON, CSV or Parquet. Rows are fetched from the DB in batches
+    and encoded as they arrive, so memory stays flat for any export size.
+    NDJSON and CSV are gzipped only if the client sends Accept-Encoding: gzip.
+    """
+    filters = {
+        "start": datetime.combine(start, datetime.min.time()) if start else None,
+        "end": datetime.combine(end + timedelta(days=1), datetime.min.time()) if end else None,
+        "vendor": vendor,
+        "document_type": document_type,
+    }
+    accepts_gzip = "gzip" in request.headers.get("accept-encoding", "").lower()
+    compress = gzip and accepts_gzip and format != "parquet"
+    headers = {"Content-Disposition": f'attachment; filename="smartdoc-results.{format}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    if format != "parquet":
+        headers["Vary"] = "Accept-Encoding"
+    api_log.info(f"Export requested: format={format} gzip={compress} filters={filters}")
+    return StreamingResponse(
+        export.stream_results(format, compress=compress, **filters),
+        media_type=export.MEDIA_TYPES[format],
+        headers=headers,
+    )
+
+
 @app.delete("/documents/{doc_id}")
 async def delete_document(doc_id: str, db=Depends(get_db)):
     ok = crud.delete_document_and_results(db, doc_id)
@@ -0,0 +1,71 @@
+import re, logging
+from functools import lru_cache
+from backend.pipeline.document_types import DOCUMENT_TYPES, DEFAULT_DOCUMENT_TYPE
+
+logger = logging.getLogger(__name__)
+
+AMOUNT_RE = re.compile(r"\d[\d,]*\.\d{2}\b")
+TIER_RANK = {"large": 1, "small": 0}
+TITLE_WEIGHT = 5  # a document naming its own type outweighs several supporting cues
+
+
+@lru_cache(maxsize=None)
+def _keyword_re(keywords: tuple[str, ...]):
+    # word boundaries, so "invoice" doesn't match inside "invoiced"
+    return re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + r")\b")
+
+
+class DocumentClassifier:
+    """Cheap local classifier over OCR text and simple layout features.
+
+    Scores every registered type by the distinct keywords found, with title
+    words ("invoice", "receipt", ...) worth TITLE_WEIGHT supporting cues, so
+    repeating one word doesn't tip the result. Layout cues only break ties
+    between the top-scoring types: receipts are short, single-page and narrow,
+    statements carry many amount-bearing lines, invoices may span pages. Any
+    remaining tie goes to the default type, then to the larger model tier, so
+    an ambiguous document is never under-served. No keyword hits at all means
+    the default type.
+    """
+
+    def classify(self, text: str, pages: int = 1) -> str:
+        lower = text.lower()
+        scores = {
+            name: TITLE_WEIGHT * self._distinct_hits(doc_type.titles, lower)
+            + self._distinct_hits(doc_type.keywords, lower)
+            for name, doc_type in DOCUMENT_TYPES.items()
+        }
+        top = max(scores.values(), default=0)
+        if top == 0:
+            logger.info(f"Classified document as {DEFAULT_DOCUMENT_TYPE} (no keyword hits)")
+            return DEFAULT_DOCUMENT_TYPE
+
+        candidates = [name for name, score in scores.items() if score == top]
+        if len(candidates) > 1:
+            candidates = self._layout_tiebreak(candidates, lower, pages)
+        best = min(
+            candidates,
+            key=lambda n: (n != DEFAULT_DOCUMENT_TYPE, -TIER_RANK.get(DOCUMENT_TYPES[n].tier, 0)),
+        )
+        logger.info(f"Classified document as {best} | scores={scores}")
+        return best
+
+    @staticmethod
+    def _distinct_hits(keywords: tuple[str, ...], lower: str) -> int:
+        return len(set(_keyword_re(keywords).findall(lower))) if keywords else 0
+
+    @staticmethod
+    def _layout_tiebreak(candidates: list[str], lower: str, pages: int) -> list[str]:
+        lines = [l for l in lower.splitlines() if l.strip()]
+        amount_lines = sum(1 for l in lines if AMOUNT_RE.search(l))
+        avg_width = sum(len(l) for l in lines) / len(lines) if lines else 0
+
+        looks_like = []
+        if pages == 1 and len(lines) < 60 and avg_width < 40:
+            looks_like.append("receipt")
+        if amount_lines > 20:
+            looks_like.append("statement")
+        if pages > 1:
+            looks_like.append("invoice")
+        preferred = [n for n in candidates if n in looks_like]
+        return preferred or candidates
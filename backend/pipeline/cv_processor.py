@@ -1,20 +1,152 @@
-from PIL import Image
+from PIL import Image, ImageDraw
 import pytesseract
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 from pathlib import Path
-import logging
+from config import settings
+from backend.pipeline.ocr_cache import OCRCache
+import bisect, logging, os, re, tempfile, time
 
 logger = logging.getLogger(__name__)
 
+# Tesseract holds a few working copies of the page (binarized, thresholded, ...)
+OCR_OVERHEAD = 4
+DEFAULT_PAGE_PTS = (612, 792)  # US letter, when pdfinfo can't tell us
+# Photos, scans and PDF pages larger than this (in letter-page areas at
+# self.dpi) are shrunk before OCR
+MAX_IMAGE_PAGES = 1.5
+PAGE_SIZE_KEY_RE = re.compile(r"Page\s+(\d+) size")
+
+# Coarse-to-fine: small-print blocks carrying one of these labels are re-read
+# at full resolution even when the coarse pass was confident
+FIELD_HINT_RE = re.compile(
+    r"\b(?:sub\s*total|total|amount\s+due|balance\s+due|invoice\s*(?:no|number|#)|tax|vat)\b", re.I
+)
+SMALL_TEXT_PTS = 8     # estimated font size below which text counts as small print
+REFINE_PAD_PX = 8      # margin (at full DPI) around a refine crop
+REFINE_GAP_PX = 40     # white gap between crops stacked into one refine mosaic
+REFINE_MAX_SHARE = 0.5 # past this share of the page, one full-page pass is cheaper
+INK_THRESHOLD = 128    # gray level below which a coarse pixel counts as ink
+MIN_ROW_INK = 2        # mean (0-255) ink per row for a row to hold uncovered print
+MIN_BAND_PX = 3        # thinner ink bands or runs (at coarse DPI) are rules or specks
+INK_RUN_GAP_PX = 12    # blank columns (at coarse DPI) that split a band into separate runs
+RULE_ROW_SHARE = 0.5   # rows inked across more of the width than this are horizontal rules
+
 class CVProcessor:
     def __init__(self):
         self.dpi = 300  # higher DPI → better OCR
+        self.mode = settings.ocr_mode  # "full" or "coarse_to_fine"
+        self.coarse_dpi = settings.ocr_coarse_dpi
+        self.refine_confidence = settings.ocr_refine_confidence
+        self.cache = (
+            OCRCache(
+                settings.ocr_cache_entries, settings.ocr_cache_dir,
+                max_disk_bytes=settings.ocr_cache_disk_mb * 1024 * 1024,
+                ttl_seconds=settings.ocr_cache_ttl_hours * 3600,
+            )
+            if settings.ocr_cache_enabled else None
+        )
+        self._tesseract_version = None
+
+    def iter_pdf_pages(self, pdf_path: Path):
+        """Rasterize a PDF one page at a time, yielding grayscale PIL images.
+
+        Pages are rendered by poppler straight to grayscale into a temp dir,
+        and each file is closed and removed before the next page is rendered,
+        so only one page is ever held in memory. Oversized pages (A3, drawings)
+        are rendered at a lower DPI, recorded in `image.info["ocr_dpi"]`.
+        """
+        sizes = self._pdf_page_sizes(pdf_path)
+        page_count = len(sizes)
+        with tempfile.TemporaryDirectory(prefix="smartdoc-") as tmp_dir:
+            for page, (w_pts, h_pts) in enumerate(sizes, start=1):
+                dpi = self._page_dpi(w_pts, h_pts)
+                if dpi < self.dpi:
+                    logger.info(f"{pdf_path.name} page {page} is {w_pts:.0f}x{h_pts:.0f} pt, rendering at {dpi} DPI")
+                paths = convert_from_path(
+                    pdf_path,
+                    dpi=dpi,
+                    first_page=page,
+                    last_page=page,
+                    grayscale=True,
+                    output_folder=tmp_dir,
+                    paths_only=True,
+                )
+                for path in paths:
+                    with Image.open(path) as image:
+                        image.info["ocr_dpi"] = dpi
+                        yield image
+                    os.unlink(path)
+        logger.info(f"Rasterized {pdf_path.name} → {page_count} page(s)")
+
+    def estimate_memory(self, file_path: Path):
+        """Estimate page count and peak bytes needed to OCR a document.
+
+        Pages are streamed, so the peak is set by the largest page rather than
+        the sum of all pages.
+        """
+        if file_path.suffix.lower() == ".pdf":
+            sizes = self._pdf_page_sizes(file_path)
+            page_bytes = max(self._page_pixels(w_pts, h_pts) for w_pts, h_pts in sizes)
+            return {"pages": len(sizes), "bytes": page_bytes * OCR_OVERHEAD}
+
+        with Image.open(file_path) as image:  # lazy: reads the header only
+            w, h = image.size
+            gray = self._ocr_pixels(w, h)
+            # JPEGs are decoded straight to grayscale, at most full size (see
+            # load_image); other formats are decoded in full before the gray copy.
+            decode = w * h * (1 if image.format == "JPEG" else len(image.getbands()))
+        return {"pages": 1, "bytes": max(decode + gray, gray * OCR_OVERHEAD)}
+
+    @staticmethod
+    def _pdf_page_sizes(pdf_path: Path) -> list[tuple[float, float]]:
+        """(width, height) in points of every page, in order. pdfinfo only
+        reports page 1's size unless it is given a page range."""
+        pages = int(pdfinfo_from_path(pdf_path).get("Pages", 1))
+        info = pdfinfo_from_path(pdf_path, first_page=1, last_page=pages)
+        sizes = {}
+        for key, value in info.items():
+            key_match = PAGE_SIZE_KEY_RE.match(key)
+            match = re.match(r"([\d.]+) x ([\d.]+)", str(value))
+            if key_match and match:
+                sizes[int(key_match[1])] = (float(match[1]), float(match[2]))
+        return [sizes.get(page, DEFAULT_PAGE_PTS) for page in range(1, pages + 1)]
+
+    def _page_dpi(self, w_pts: float, h_pts: float) -> int:
+        """self.dpi, lowered so the rendered page fits within _max_ocr_pixels."""
+        pixels = (w_pts / 72 * self.dpi) * (h_pts / 72 * self.dpi)
+        return min(self.dpi, int(self.dpi * (self._max_ocr_pixels() / pixels) ** 0.5))
 
-    def pdf_to_images(self, pdf_path: Path):
-        """Convert a PDF into a list of PIL images"""
-        images = convert_from_path(pdf_path, dpi=self.dpi)
-        logger.info(f"Converted {pdf_path.name} → {len(images)} page(s)")
-        return images
+    def _page_pixels(self, w_pts: float, h_pts: float) -> int:
+        dpi = self._page_dpi(w_pts, h_pts)
+        return int(w_pts / 72 * dpi) * int(h_pts / 72 * dpi)
+
+    def _max_ocr_pixels(self) -> int:
+        w_pts, h_pts = DEFAULT_PAGE_PTS
+        return int(MAX_IMAGE_PAGES * (w_pts / 72 * self.dpi) * (h_pts / 72 * self.dpi))
+
+    def max_page_bytes(self) -> int:
+        """Working set of the largest page or photo we OCR (see load_image
+        and _page_dpi)."""
+        return self._max_ocr_pixels() * OCR_OVERHEAD
+
+    def _ocr_pixels(self, w: int, h: int) -> int:
+        return min(w * h, self._max_ocr_pixels())
+
+    def load_image(self, file_path: Path) -> Image.Image:
+        """Open an image file for OCR as grayscale, shrunk to at most
+        MAX_IMAGE_PAGES letter pages' worth of pixels at self.dpi (a 12 MP phone
+        photo carries no more legible detail than a 300 DPI page scan)."""
+        image = Image.open(file_path)
+        w, h = image.size
+        scale = min(1.0, (self._max_ocr_pixels() / (w * h)) ** 0.5)
+        target = (max(1, int(w * scale)), max(1, int(h * scale)))
+        if image.format == "JPEG":
+            image.draft("L", target)  # decode in grayscale at a reduced DCT scale
+        gray = image.convert("L")
+        image.close()
+        if gray.size[0] * gray.size[1] > target[0] * target[1]:
+            gray = gray.resize(target, Image.BILINEAR)
+        return gray
 
     def preprocess_image(self, image: Image.Image):
         """Basic preprocessing before OCR"""
@@ -22,9 +154,41 @@ class CVProcessor:
             image = image.convert("L")  # grayscale
         return image
 
+    def ocr_settings(self) -> tuple:
+        """Everything besides the pixels that affects OCR output (part of the cache key)."""
+        if self._tesseract_version is None:
+            try:
+                self._tesseract_version = str(pytesseract.get_tesseract_version())
+            except Exception:
+                self._tesseract_version = "unknown"
+        return (self._tesseract_version, self.mode, self.dpi, self.coarse_dpi, self.refine_confidence)
+
     def extract_text(self, image: Image.Image):
-        """Run Tesseract OCR and compute average confidence"""
+        """OCR one page, going through the page cache when it's enabled.
+
+        Besides text and confidence, the result says which cache tier served it
+        ("memory", "disk" or None) and how long Tesseract took (or took
+        originally, for a cache hit).
+        """
         processed = self.preprocess_image(image)
+        key = None
+        if self.cache:
+            key = self.cache.key(processed, self.ocr_settings())
+            entry, tier = self.cache.get(key)
+            if entry:
+                return {**entry["result"], "cache": tier, "ocr_seconds": entry["ocr_seconds"]}
+
+        start = time.perf_counter()
+        result = self.run_ocr(processed)
+        elapsed = time.perf_counter() - start
+        if self.cache:
+            self.cache.put(key, {"result": result, "ocr_seconds": elapsed})
+        return {**result, "cache": None, "ocr_seconds": elapsed}
+
+    def run_ocr(self, processed: Image.Image):
+        """Run Tesseract OCR and compute average confidence"""
+        if self.mode == "coarse_to_fine":
+            return self.extract_text_coarse_to_fine(processed)
         ocr_data = pytesseract.image_to_data(processed, output_type=pytesseract.Output.DICT)
         text = pytesseract.image_to_string(processed)
 
@@ -32,18 +196,240 @@ class CVProcessor:
         avg_conf = sum(confs) / len(confs) if confs else 0
         return {"text": text, "confidence": avg_conf / 100}
 
+    @staticmethod
+    def _words(ocr_data, scale: float = 1.0, offset=(0, 0)):
+        """Yield (word, conf, box, line_key) from image_to_data output, with
+        boxes mapped back to full-resolution pixels via `scale` and `offset`."""
+        for i, word in enumerate(ocr_data["text"]):
+            conf = float(ocr_data["conf"][i])
+            if conf < 0 or not word.strip():
+                continue
+            left = ocr_data["left"][i] / scale + offset[0]
+            top = ocr_data["top"][i] / scale + offset[1]
+            w, h = ocr_data["width"][i] / scale, ocr_data["height"][i] / scale
+            line_key = (ocr_data["block_num"][i], ocr_data["par_num"][i], ocr_data["line_num"][i])
+            yield word, conf, (left, top, left + w, top + h), line_key
+
+    @classmethod
+    def _blocks(cls, ocr_data, scale: float = 1.0):
+        """Group image_to_data words into blocks of lines."""
+        blocks = {}
+        for word, conf, box, line_key in cls._words(ocr_data, scale):
+            block = blocks.setdefault(line_key[0], {"lines": {}, "words": []})
+            block["lines"].setdefault(line_key, []).append(word)
+            block["words"].append((word, conf, box))
+        return list(blocks.values())
+
+    @staticmethod
+    def _font_pts(word: str, height_px: float, dpi: int) -> float:
+        """Estimate font size from a word box: the box spans the x-height plus
+        ascenders (caps, digits, b/d/f/h/k/l/t) and descenders (g/j/p/q/y) when
+        the word has them, roughly 0.5 / +0.22 / +0.22 of the em."""
+        em_share = 0.5
+        if any(c.isupper() or c.isdigit() or c in "bdfhklt" for c in word):
+            em_share += 0.22
+        if any(c in "gjpqy,;" for c in word):
+            em_share += 0.22
+        return height_px / em_share / dpi * 72
+
+    def _needs_refine(self, block, dpi: int) -> bool:
+        confs = [c for _, c, _ in block["words"]]
+        if sum(confs) / len(confs) < self.refine_confidence * 100:
+            return True
+        text = " ".join(w for w, _, _ in block["words"])
+        if not FIELD_HINT_RE.search(text):
+            return False
+        sizes = sorted(self._font_pts(w, b[3] - b[1], dpi) for w, _, b in block["words"])
+        return sizes[len(sizes) // 2] < SMALL_TEXT_PTS
+
+    @staticmethod
+    def _overlaps(a, b) -> bool:
+        """True if two boxes share more than half of the smaller one's area."""
+        w = min(a[2], b[2]) - max(a[0], b[0])
+        h = min(a[3], b[3]) - max(a[1], b[1])
+        if w <= 0 or h <= 0:
+            return False
+        smaller = min((a[2] - a[0]) * (a[3] - a[1]), (b[2] - b[0]) * (b[3] - b[1]))
+        return w * h > 0.5 * smaller
+
+    @staticmethod
+    def _uncovered_ink(coarse: Image.Image, blocks, scale: float):
+        """Full-resolution boxes of ink the coarse pass produced no words for,
+        i.e. print too small to read at coarse DPI.
+
+        Horizontal rules are blanked first, then each band of inked rows is
+        split into runs of inked columns. Thin runs (vertical rules) and runs
+        touching a word the coarse pass already read are dropped, so bordered
+        table rows aren't read a second time."""
+        ink = coarse.point(lambda p: 255 if p < INK_THRESHOLD else 0)
+        draw = ImageDraw.Draw(ink)
+        word_boxes = []
+        for block in blocks:
+            for _, _, (l, t, r, b) in block["words"]:
+                box = (l * scale - 2, t * scale - 2, r * scale + 2, b * scale + 2)
+                draw.rectangle(box, fill=0)
+                word_boxes.append(box)
+
+        # Row/column ink projections via box-filter downscaling
+        rows = list(ink.resize((1, ink.height), Image.BOX).getdata())
+        for y, v in enumerate(rows):
+            if v > 255 * RULE_ROW_SHARE:
+                draw.line([(0, y), (ink.width, y)], fill=0)
+                rows[y] = 0
+        regions, y = [], 0
+        while y < ink.height:
+            if rows[y] < MIN_ROW_INK:
+                y += 1
+                continue
+            start = y
+            while y < ink.height and rows[y] >= MIN_ROW_INK:
+                y += 1
+            if y - start < MIN_BAND_PX:
+                continue
+            cols = list(ink.crop((0, start, ink.width, y)).resize((ink.width, 1), Image.BOX).getdata())
+            runs, gap = [], INK_RUN_GAP_PX + 1
+            for x, v in enumerate(cols):
+                if not v:
+                    gap += 1
+                    continue
+                if gap > INK_RUN_GAP_PX:
+                    runs.append([x, x + 1])
+                runs[-1][1] = x + 1
+                gap = 0
+            for x0, x1 in runs:
+                if x1 - x0 < MIN_BAND_PX:
+                    continue
+                if any(x0 < b[2] and b[0] < x1 and start < b[3] and b[1] < y for b in word_boxes):
+                    continue
+                regions.append((x0 / scale, start / scale, x1 / scale, y / scale))
+        return regions
+
+    def _ocr_regions(self, image: Image.Image, regions, kept_boxes: list):
+        """OCR many page regions with a single Tesseract call by stacking the
+        crops into one mosaic (process startup dominates on small crops).
+        Returns one block (lines + words, in page coordinates) per region.
+
+        Words overlapping one in `kept_boxes` are dropped, since overlapping
+        regions would otherwise read the same print twice; every word kept
+        is added to `kept_boxes`."""
+        crops = [image.crop(r) for r in regions]
+        mosaic = Image.new(
+            "L",
+            (max(c.width for c in crops), sum(c.height + REFINE_GAP_PX for c in crops) + REFINE_GAP_PX),
+            255,
+        )
+        strips, y = [], REFINE_GAP_PX
+        for crop in crops:
+            mosaic.paste(crop, (0, y))
+            strips.append(y)
+            y += crop.height + REFINE_GAP_PX
+
+        # psm 6: one uniform block of text; the gaps keep crops on separate lines
+        data = pytesseract.image_to_data(mosaic, config="--psm 6", output_type=pytesseract.Output.DICT)
+        out = [{"lines": {}, "words": []} for _ in regions]
+        for word, conf, (l, t, r, b), line_key in self._words(data):
+            i = max(0, bisect.bisect_right(strips, (t + b) / 2) - 1)
+            dx, dy = regions[i][0], regions[i][1] - strips[i]
+            box = (l + dx, t + dy, r + dx, b + dy)
+            if any(self._overlaps(box, kept) for kept in kept_boxes):
+                continue
+            kept_boxes.append(box)
+            out[i]["lines"].setdefault(line_key, []).append(word)
+            out[i]["words"].append((word, conf, box))
+        return out
+
+    def extract_text_coarse_to_fine(self, image: Image.Image):
+        """Two-pass OCR: read the whole page at `coarse_dpi`, then re-read at full
+        DPI only what needs it: blocks with low confidence, small-print blocks
+        carrying field labels (totals, invoice numbers, tax), and inked areas
+        the coarse pass found no words in. All re-reads share one Tesseract call."""
+        dpi = image.info.get("ocr_dpi", self.dpi)  # lower for oversized PDF pages
+        scale = min(1.0, self.coarse_dpi / dpi)
+        coarse = image.resize(
+            (max(1, int(image.width * scale)), max(1, int(image.height * scale))), Image.BILINEAR
+        )
+        data = pytesseract.image_to_data(coarse, output_type=pytesseract.Output.DICT)
+        blocks = self._blocks(data, scale)
+
+        def padded(l, t, r, b):
+            return (
+                max(0, int(l) - REFINE_PAD_PX), max(0, int(t) - REFINE_PAD_PX),
+                min(image.width, int(r) + REFINE_PAD_PX), min(image.height, int(b) + REFINE_PAD_PX),
+            )
+
+        targets = []  # (index into blocks, or None for uncovered ink, region)
+        for i, block in enumerate(blocks):
+            if self._needs_refine(block, dpi):
+                boxes = [box for _, _, box in block["words"]]
+                targets.append((i, padded(
+                    min(b[0] for b in boxes), min(b[1] for b in boxes),
+                    max(b[2] for b in boxes), max(b[3] for b in boxes),
+                )))
+        targets += [(None, padded(*r)) for r in self._uncovered_ink(coarse, blocks, scale)]
+
+        area = sum((r[2] - r[0]) * (r[3] - r[1]) for _, r in targets)
+        if area > REFINE_MAX_SHARE * image.width * image.height:
+            # Re-reading most of the page piecemeal costs more than one full pass
+            logger.info("Coarse-to-fine OCR: most of the page needs full DPI, reading it whole")
+            blocks = self._blocks(pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT))
+            targets = []
+        elif targets:
+            # Refined blocks are replaced wholesale; words of every other block stay
+            replaced = {i for i, _ in targets if i is not None}
+            kept_boxes = [
+                box for k, block in enumerate(blocks) if k not in replaced for _, _, box in block["words"]
+            ]
+            fine = self._ocr_regions(image, [r for _, r in targets], kept_boxes)
+            extra = []
+            for (i, _), block in zip(targets, fine):
+                if not block["words"]:
+                    continue
+                if i is None:
+                    extra.append(block)
+                else:
+                    blocks[i] = block
+            # Slot newly found print in before the first block that starts below it
+            for block in extra:
+                top = min(b[1] for _, _, b in block["words"])
+                at = next(
+                    (k for k, other in enumerate(blocks) if min(b[1] for _, _, b in other["words"]) > top),
+                    len(blocks),
+                )
+                blocks.insert(at, block)
+
+        text = "\n\n".join(
+            "\n".join(" ".join(words) for _, words in sorted(block["lines"].items()))
+            for block in blocks
+        )
+        confs = [c for block in blocks for _, c, _ in block["words"]]
+        logger.info(f"Coarse-to-fine OCR: re-read {len(targets)} region(s) at {dpi} DPI")
+        return {
+            "text": text,
+            "confidence": (sum(confs) / len(confs) / 100) if confs else 0,
+            "refined_blocks": len(targets),
+        }
+
     def process_document(self, file_path: Path):
         """Main entry point"""
         if file_path.suffix.lower() == ".pdf":
-            images = self.pdf_to_images(file_path)
-            image = images[0]  # first page only for now
+            pages = [self.extract_text(image) for image in self.iter_pdf_pages(file_path)]
         else:
-            image = Image.open(file_path)
+            with self.load_image(file_path) as image:
+                pages = [self.extract_text(image)]
 
-        result = self.extract_text(image)
+        text = "\f".join(p["text"] for p in pages)
+        confidence = sum(p["confidence"] for p in pages) / len(pages) if pages else 0
+        hits = [p for p in pages if p.get("cache")]
         return {
             "file": file_path.name,
-            "text": result["text"],
-            "confidence": result["confidence"],
-            "word_count": len(result["text"].split())
+            "text": text,
+            "confidence": confidence,
+            "word_count": len(text.split()),
+            "pages": len(pages),
+            "cache_hits": {
+                "memory": sum(1 for p in hits if p["cache"] == "memory"),
+                "disk": sum(1 for p in hits if p["cache"] == "disk"),
+            },
+            "cache_misses": len(pages) - len(hits) if self.cache else 0,
+            "ocr_seconds_saved": sum(p["ocr_seconds"] for p in hits),
         }
@@ -1,7 +1,8 @@
 from pathlib import Path
 from backend.pipeline.cv_processor import CVProcessor
 from backend.pipeline.llm_processor import LLMProcessor
-import logging
+from backend.pipeline.classifier import DocumentClassifier
+import logging, time
 
 logger = logging.getLogger("smartdoc")
 
@@ -9,6 +10,7 @@ class DocumentProcessor:
     def __init__(self):
         self.cv = CVProcessor()
         self.llm = LLMProcessor()
+        self.classifier = DocumentClassifier()
 
     def process(self, file_path: Path):
         logger.info(f"🟢 Starting document processing: {file_path}")
@@ -22,16 +24,33 @@ class DocumentProcessor:
                 f"Words={ocr_result.get('word_count', 0)}"
             )
 
+            # ---- Classification stage ----
+            doc_type = self.classifier.classify(ocr_result["text"], ocr_result.get("pages", 1))
+
             # ---- LLM stage ----
-            llm_result = self.llm.extract_fields(ocr_result["text"])
-            logger.info(f"LLM extraction complete for {file_path.name}")
+            llm_start = time.time()
+            llm_result, usage = self.llm.extract_fields(ocr_result["text"], doc_type)
+            llm_duration = time.time() - llm_start
+            logger.info(
+                f"LLM extraction complete for {file_path.name} | "
+                f"Type={doc_type} | Model={usage['model']} | Cost=${usage['cost']:.5f}"
+            )
 
             result = {
                 "file": file_path.name,
+                "document_type": doc_type,
+                "model": usage["model"],
+                "tokens_used": usage["tokens_used"],
+                "processing_cost": usage["cost"],
+                "llm_duration": llm_duration,
                 "ocr": {
                     "text": ocr_result["text"],
                     "confidence": ocr_result["confidence"],
-                    "word_count": ocr_result["word_count"]
+                    "word_count": ocr_result["word_count"],
+                    "pages": ocr_result.get("pages", 1),
+                    "cache_hits": ocr_result.get("cache_hits", {}),
+                    "cache_misses": ocr_result.get("cache_misses", 0),
+                    "ocr_seconds_saved": ocr_result.get("ocr_seconds_saved", 0.0),
                 },
                 "extracted_data": llm_result
             }
@@ -0,0 +1,105 @@
+from dataclasses import dataclass
+from typing import Optional, Type
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from config import settings
+
+
+class ExtractedFields(BaseModel):
+    """Base for per-type field schemas. LLMs return numbers and strings
+    interchangeably, so numbers are coerced and unknown keys dropped."""
+    model_config = ConfigDict(coerce_numbers_to_str=True, extra="ignore")
+
+    @field_validator("*", mode="before")
+    @classmethod
+    def _scalar_or_none(cls, value):
+        """Null out values that aren't strings or numbers (objects, lists,
+        booleans) so one odd field doesn't void the whole extraction."""
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return None
+        return value
+
+
+class ReceiptFields(ExtractedFields):
+    vendor: Optional[str] = Field(None, description="store or merchant name")
+    date: Optional[str] = Field(None, description="purchase date")
+    total_amount: Optional[str] = Field(None, description="amount paid")
+    payment_method: Optional[str] = Field(None, description="cash, card, etc.")
+
+
+class InvoiceFields(ExtractedFields):
+    invoice_number: Optional[str] = Field(None, description="invoice number")
+    date: Optional[str] = Field(None, description="invoice date")
+    total_amount: Optional[str] = Field(None, description="total amount due")
+    vendor: Optional[str] = Field(None, description="issuing company")
+    due_date: Optional[str] = Field(None, description="payment due date")
+    tax_amount: Optional[str] = Field(None, description="total tax / VAT")
+    currency: Optional[str] = Field(None, description="ISO currency code")
+
+
+class StatementFields(ExtractedFields):
+    account_holder: Optional[str] = Field(None, description="name on the account")
+    account_number: Optional[str] = Field(None, description="account number")
+    period_start: Optional[str] = Field(None, description="statement period start date")
+    period_end: Optional[str] = Field(None, description="statement period end date")
+    opening_balance: Optional[str] = Field(None, description="opening balance")
+    closing_balance: Optional[str] = Field(None, description="closing balance")
+    vendor: Optional[str] = Field(None, description="bank or issuing institution")
+
+
+@dataclass
+class DocumentType:
+    name: str
+    schema: Type[ExtractedFields]
+    tier: str  # "small" or "large", see LLMProcessor.MODEL_TIERS
+    titles: tuple[str, ...] = ()    # words a document of this type calls itself; weigh heavily
+    keywords: tuple[str, ...] = ()  # supporting cues, each counted once
+
+    @property
+    def expected_keys(self):
+        return list(self.schema.model_fields)
+
+    def validate(self, raw_json: str) -> dict:
+        """Validate LLM output with the schema's compiled pydantic validator.
+
+        Fields are checked independently (see ExtractedFields); only output
+        that isn't a JSON object at all raises.
+        """
+        return self.schema.model_validate_json(raw_json).model_dump()
+
+    def empty(self) -> dict:
+        return {k: None for k in self.expected_keys}
+
+
+# Registry of known document types. Add entries with register_document_type();
+# tiers can be overridden per deployment via DOCUMENT_TYPE_TIERS='{"invoice": "small"}'.
+DOCUMENT_TYPES: dict[str, DocumentType] = {}
+DEFAULT_DOCUMENT_TYPE = "invoice"
+
+
+def register_document_type(doc_type: DocumentType):
+    doc_type.tier = settings.document_type_tiers.get(doc_type.name, doc_type.tier)
+    DOCUMENT_TYPES[doc_type.name] = doc_type
+    return doc_type
+
+
+def get_document_type(name: str | None) -> DocumentType:
+    return DOCUMENT_TYPES.get(name or DEFAULT_DOCUMENT_TYPE, DOCUMENT_TYPES[DEFAULT_DOCUMENT_TYPE])
+
+
+# Supporting keywords should be specific to their type: totals, tax lines and
+# card brands appear on invoices as often as on receipts, so they're left out.
+register_document_type(DocumentType(
+    "receipt", ReceiptFields, tier="small",
+    titles=("receipt",),
+    keywords=("cashier", "change due", "thank you for shopping", "cash tendered", "card ending"),
+))
+register_document_type(DocumentType(
+    "invoice", InvoiceFields, tier="large",
+    titles=("invoice",),
+    keywords=("bill to", "ship to", "due date", "payment terms", "po number", "qty", "unit price"),
+))
+register_document_type(DocumentType(
+    "statement", StatementFields, tier="large",
+    titles=("statement",),
+    keywords=("opening balance", "closing balance", "account summary", "statement period", "withdrawals", "deposits"),
+))
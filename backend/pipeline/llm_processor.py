@@ -1,8 +1,24 @@
-import os, json, logging
+import os, logging
 from openai import OpenAI
+from config import settings
+from backend.pipeline.document_types import get_document_type
 
 logger = logging.getLogger(__name__)
 
+# Model used for each cost tier, per provider
+MODEL_TIERS = {
+    "openai": {"small": "gpt-4o-mini", "large": "gpt-4o"},
+    "kimi": {"small": "moonshot-v1-8k", "large": "kimi-k2-0905-preview"},
+}
+
+# USD per 1M tokens: (input, output)
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "moonshot-v1-8k": (0.20, 2.00),
+    "kimi-k2-0905-preview": (0.60, 2.50),
+}
+
 class LLMProcessor:
     def __init__(self):
         self.use_kimi = os.getenv("USE_KIMI_API", "false").lower() == "true"
@@ -23,33 +39,54 @@ class LLMProcessor:
                 api_key=self.kimi_key,
                 base_url="https://api.moonshot.ai/v1"
             )
-            self.model = "kimi-k2-0905-preview"
-            logger.info(f"Initialized Kimi client with model: {self.model}")
+            self.provider = "kimi"
+            self.models = self._tier_models()
+            logger.info(f"Initialized Kimi client with models: {self.models}")
         else:
             if not self.openai_key:
                 logger.error("OPENAI_API_KEY not found in environment!")
             # fallback to OpenAI
             self.client = OpenAI(api_key=self.openai_key)
-            self.model = "gpt-4o"
-            logger.info(f"Initialized OpenAI client with model: {self.model}")
+            self.provider = "openai"
+            self.models = self._tier_models()
+            logger.info(f"Initialized OpenAI client with models: {self.models}")
+
+    def _tier_models(self):
+        models = dict(MODEL_TIERS[self.provider])
+        if settings.llm_small_model:
+            models["small"] = settings.llm_small_model
+        if settings.llm_large_model:
+            models["large"] = settings.llm_large_model
+        return models
+
+    def estimate_cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        in_price, out_price = MODEL_PRICING.get(model, (0.0, 0.0))
+        return (prompt_tokens * in_price + completion_tokens * out_price) / 1_000_000
 
-    def extract_fields(self, document_text: str):
-        """Extract structured data (invoice_number, date, total_amount, vendor)."""
+    def extract_fields(self, document_text: str, doc_type: str | None = None):
+        """Extract the fields of `doc_type`'s schema using that type's model tier.
+
+        Returns (fields, usage) where usage carries model, tokens_used and cost.
+        """
+        spec = get_document_type(doc_type)
+        model = self.models.get(spec.tier, self.models["large"])
+        field_list = "\n".join(
+            f"        - {name}: {field.description}" for name, field in spec.schema.model_fields.items()
+        )
         prompt = f"""
-        Extract the following fields from this document and return JSON only:
-        - invoice_number
-        - date
-        - total_amount
-        - vendor
+        This is a {spec.name}. Extract the following fields from it and return JSON only
+        (use null for anything missing):
+{field_list}
 
         Document text:
         {document_text[:4000]}
         """
+        usage = {"model": model, "tokens_used": 0, "cost": 0.0}
 
         try:
-            logger.info(f"Calling LLM API with model: {self.model}")
+            logger.info(f"Calling LLM API with model: {model} ({spec.name}, tier={spec.tier})")
             response = self.client.chat.completions.create(
-                model=self.model,
+                model=model,
                 messages=[
                     {"role": "system", "content": "You are an expert document extraction assistant."},
                     {"role": "user", "content": prompt}
@@ -57,25 +94,26 @@ class LLMProcessor:
                 temperature=0
             )
             content = response.choices[0].message.content
+            if response.usage:
+                usage["tokens_used"] = response.usage.total_tokens
+                usage["cost"] = self.estimate_cost(
+                    model, response.usage.prompt_tokens, response.usage.completion_tokens
+                )
 
             # 🧹 Clean fenced JSON if present
             if "```" in content:
                 content = content.split("```")[-2]
+                if content.startswith("json"):
+                    content = content[4:]
 
-            # 🛡️ JSON railguard starts here
-            expected_keys = ["invoice_number", "date", "total_amount", "vendor"]
-
+            # 🛡️ JSON railguard: validate against the type's schema
             try:
-                parsed = json.loads(content.strip())
-                clean = {k: parsed.get(k, None) for k in expected_keys}
-                return clean
+                return spec.validate(content.strip()), usage
             except Exception as e:
-                logger.error(f"JSON parse/validation failed: {e}")
-                return {k: None for k in expected_keys}
+                logger.error(f"JSON parse/validation failed for {spec.name}: {e}")
+                return spec.empty(), usage
 
         except Exception as e:
             # 🔍 Log the full exception details
             logger.error(f"LLM extraction failed: {e}", exc_info=True)
-            return {"error": str(e)}
-        
-        #
\ No newline at end of file
+            return {"error": str(e)}, usage
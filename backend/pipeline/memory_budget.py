@@ -0,0 +1,67 @@
+from pathlib import Path
+import threading, logging
+
+logger = logging.getLogger(__name__)
+
+# cgroup v2, then v1
+CGROUP_LIMIT_FILES = ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+BUDGET_SHARE_OF_LIMIT = 0.5  # the rest is Python, poppler, the LLM client, request buffers
+FALLBACK_BUDGET_MB = 2048    # no container limit found (e.g. local dev)
+
+
+def container_memory_limit() -> int | None:
+    """Memory limit of the container we run in, in bytes, or None if unlimited/unknown."""
+    for path in CGROUP_LIMIT_FILES:
+        try:
+            raw = Path(path).read_text().strip()
+        except OSError:
+            continue
+        # v2 says "max" when unlimited, v1 reports a huge page-rounded number
+        if raw.isdigit() and int(raw) < 1 << 60:
+            return int(raw)
+    return None
+
+
+def default_budget_bytes() -> int:
+    limit = container_memory_limit()
+    return int(limit * BUDGET_SHARE_OF_LIMIT) if limit else FALLBACK_BUDGET_MB * 1024 * 1024
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when a document can't be admitted within the memory budget"""
+
+
+class MemoryBudget:
+    """Process-wide byte budget for rasterized pages.
+
+    Each document reserves its estimated working set before OCR starts and
+    releases it when done. Reservations larger than the whole budget are
+    rejected outright; otherwise callers wait (up to `timeout`) for room.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int, timeout: float | None = None):
+        if nbytes > self.limit:
+            raise MemoryBudgetExceeded(
+                f"Document needs ~{nbytes / 1e6:.0f} MB, budget is {self.limit / 1e6:.0f} MB"
+            )
+        with self._cond:
+            ok = self._cond.wait_for(lambda: self.in_use + nbytes <= self.limit, timeout)
+            if not ok:
+                raise MemoryBudgetExceeded(
+                    f"Timed out waiting for {nbytes / 1e6:.0f} MB "
+                    f"({self.in_use / 1e6:.0f}/{self.limit / 1e6:.0f} MB in use)"
+                )
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+            logger.info(f"Memory budget: reserved {nbytes} bytes ({self.in_use}/{self.limit})")
+
+    def release(self, nbytes: int):
+        with self._cond:
+            self.in_use = max(0, self.in_use - nbytes)
+            self._cond.notify_all()
@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from pathlib import Path
+from PIL import Image
+import hashlib, json, logging, os, tempfile, threading, time
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1  # bump when the shape of cached OCR results changes
+PRUNE_INTERVAL_SECONDS = 60  # how often a worker checks the disk tier against its limits
+PRUNE_TARGET = 0.9           # evict down to this share of max_disk_bytes, so prunes don't run back to back
+
+
+class OCRCache:
+    """Two-tier cache of per-page OCR results.
+
+    Keyed by a hash of the preprocessed page pixels plus the OCR settings, so
+    identical pages inside different files (T&C pages, cover sheets, re-scans)
+    are only OCR'd once. A bounded in-memory LRU sits in front of a directory
+    of JSON files that is shared by every worker.
+
+    Entries expire `ttl_seconds` after they were first cached, however often
+    they are hit. On disk a file's mtime is its creation time and is never
+    touched again; its atime records the last hit and drives LRU eviction
+    once the directory grows past `max_disk_bytes`. Every worker
+    periodically deletes expired and evicted files.
+    """
+
+    def __init__(self, max_entries: int, disk_dir: str | None,
+                 max_disk_bytes: int = 0, ttl_seconds: float = 0):
+        self.max_entries = max_entries
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+        self._memory: OrderedDict[str, tuple[dict, float]] = OrderedDict()  # key -> (entry, created)
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    @staticmethod
+    def key(image: Image.Image, ocr_settings: tuple) -> str:
+        h = hashlib.blake2b(digest_size=20)
+        h.update(repr((CACHE_VERSION, image.mode, image.size, ocr_settings)).encode())
+        h.update(image.tobytes())
+        return h.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str):
+        """Return (entry, tier) with tier "memory" or "disk", or (None, None)."""
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                if not self._expired(cached[1], now):
+                    self._memory.move_to_end(key)
+                    return cached[0], "memory"
+                del self._memory[key]
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                created = path.stat().st_mtime
+                if self._expired(created, now):
+                    path.unlink(missing_ok=True)
+                    return None, None
+                entry = json.loads(path.read_text(encoding="utf-8"))
+                os.utime(path, (now, created))  # atime = last hit, mtime stays the creation time
+            except (OSError, ValueError):
+                return None, None
+            self._remember(key, entry, created)
+            self._maybe_prune()
+            return entry, "disk"
+        return None, None
+
+    def put(self, key: str, entry: dict):
+        self._remember(key, entry, time.time())
+        if self.disk_dir:
+            path = self._path(key)
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # write-then-rename so other workers never read a partial file
+                fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f, ensure_ascii=False)
+                os.replace(tmp, path)
+            except OSError as e:
+                logger.warning(f"Could not write OCR cache entry {key}: {e}")
+            self._maybe_prune()
+
+    def _remember(self, key: str, entry: dict, created: float):
+        with self._lock:
+            self._memory[key] = (entry, created)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _expired(self, mtime: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - mtime > self.ttl_seconds
+
+    def _maybe_prune(self):
+        now = time.monotonic()
+        with self._lock:
+            if now < self._next_prune:
+                return
+            self._next_prune = now + PRUNE_INTERVAL_SECONDS
+        try:
+            self.prune()
+        except OSError as e:
+            logger.warning(f"Could not prune OCR cache: {e}")
+
+    def prune(self):
+        """Drop expired disk entries (by mtime), then the least recently used
+        ones (by atime) until the directory is back under PRUNE_TARGET of
+        max_disk_bytes. Safe to run from several workers at once."""
+        now = time.time()
+        files, total, removed = [], 0, 0
+        for sub in os.scandir(self.disk_dir):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                try:
+                    st = f.stat()
+                except FileNotFoundError:
+                    continue
+                if self._expired(st.st_mtime, now):
+                    Path(f.path).unlink(missing_ok=True)
+                    removed += 1
+                else:
+                    files.append((st.st_atime, st.st_size, f.path))
+                    total += st.st_size
+
+        if self.max_disk_bytes > 0 and total > self.max_disk_bytes:
+            files.sort()
+            target = self.max_disk_bytes * PRUNE_TARGET
+            for _, size, path in files:
+                if total <= target:
+                    break
+                Path(path).unlink(missing_ok=True)
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"OCR cache: evicted {removed} disk entries, {total / 1e6:.0f} MB left")
@@ -0,0 +1,137 @@
+import asyncio, itertools, logging, time
+from collections import deque
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+LANES = ("interactive", "bulk")
+PDF_PAGE_COST = 1.0    # one rasterized + OCR'd page is the unit of cost
+IMAGE_COST = 1.0
+COST_PER_MB = 0.1      # big uploads cost a bit more to decode and store
+
+
+def estimate_cost(suffix: str, size_bytes: int, pages: int) -> float:
+    """Rough relative cost of a document, in 'pages of OCR'."""
+    base = PDF_PAGE_COST * max(1, pages) if suffix.lower() == ".pdf" else IMAGE_COST
+    return base + COST_PER_MB * size_bytes / 1_000_000
+
+
+@dataclass
+class Ticket:
+    lane: str
+    client: str
+    cost: float
+    enqueued_at: float = field(default_factory=time.monotonic)
+    started_at: float | None = None
+    future: asyncio.Future | None = None
+    seq: int = 0
+
+
+class Scheduler:
+    """Start-time fair queuing of pipeline work, across lanes and then across clients.
+
+    Every lane, and every client within a lane, carries a start tag and a
+    finish tag. Dispatching a ticket sets the virtual clock to its start tag
+    and moves the finish tag to start + cost / weight. Work that arrives at
+    an idle lane or client starts at max(clock, its last finish), so it
+    neither banks credit while idle nor pays for the job that is currently
+    running. The smallest start tag goes next: a client submitting a batch
+    of 40-page PDFs can't starve anyone else, and the interactive lane gets
+    `weight` times the bulk share. At most `concurrency` tickets run at once
+    and bulk work never takes the last slot, so an interactive request never
+    waits behind a long bulk job; that needs a concurrency of at least 2.
+    """
+
+    def __init__(self, concurrency: int, weights: dict[str, float]):
+        if concurrency < 2:
+            raise ValueError(
+                f"Scheduler concurrency must be at least 2 (one slot is reserved "
+                f"for interactive work), got {concurrency}"
+            )
+        self.concurrency = concurrency
+        self.weights = {lane: float(weights.get(lane, 1.0)) for lane in LANES}
+        self.running = 0
+        self.running_by_lane = {lane: 0 for lane in LANES}
+        self._queues: dict[str, dict[str, deque]] = {lane: {} for lane in LANES}
+        self._vtime = 0.0
+        self._lane_start = {lane: 0.0 for lane in LANES}
+        self._lane_finish = {lane: 0.0 for lane in LANES}
+        self._lane_vtime = {lane: 0.0 for lane in LANES}  # client-level clock per lane
+        self._client_start: dict[tuple[str, str], float] = {}
+        self._client_finish: dict[tuple[str, str], float] = {}
+        self._seq = itertools.count()
+
+    def queued(self, lane: str) -> int:
+        return sum(len(q) for q in self._queues[lane].values())
+
+    async def acquire(self, lane: str, client: str, cost: float) -> Ticket:
+        """Wait for a slot. The returned ticket must be passed to release()."""
+        ticket = Ticket(lane, client, cost, seq=next(self._seq))
+        ticket.future = asyncio.get_running_loop().create_future()
+        self._enqueue(ticket)
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            # Caller went away: drop the ticket, or give back a slot it was just granted
+            if ticket.started_at is None:
+                self._queues[lane][client].remove(ticket)
+                if not self._queues[lane][client]:
+                    del self._queues[lane][client]
+                    del self._client_start[(lane, client)]
+            else:
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket):
+        self.running -= 1
+        self.running_by_lane[ticket.lane] -= 1
+        self._dispatch()
+
+    def _has_room(self, lane: str) -> bool:
+        if lane == "bulk":
+            return self.running_by_lane["bulk"] < self.concurrency - 1
+        return True
+
+    def _enqueue(self, ticket: Ticket):
+        lane = self._queues[ticket.lane]
+        if not lane:
+            self._lane_start[ticket.lane] = max(self._vtime, self._lane_finish[ticket.lane])
+        key = (ticket.lane, ticket.client)
+        if ticket.client not in lane:
+            clock = self._lane_vtime[ticket.lane]
+            self._client_start[key] = max(clock, self._client_finish.get(key, 0.0))
+            # Finish tags at or behind the clock no longer matter
+            for stale in [k for k, f in self._client_finish.items()
+                          if k[0] == ticket.lane and f <= clock and k[1] not in lane]:
+                del self._client_finish[stale]
+            lane[ticket.client] = deque()
+        lane[ticket.client].append(ticket)
+
+    def _dispatch(self):
+        while self.running < self.concurrency:
+            lanes = [l for l in LANES if self.queued(l) and self._has_room(l)]
+            if not lanes:
+                return
+            lane = min(lanes, key=lambda l: self._lane_start[l])
+            queues = self._queues[lane]
+            client = min(queues, key=lambda c: (self._client_start[(lane, c)], queues[c][0].seq))
+            ticket = queues[client].popleft()
+
+            self._vtime = self._lane_start[lane]
+            self._lane_finish[lane] = self._vtime + ticket.cost / self.weights[lane]
+            self._lane_start[lane] = self._lane_finish[lane]
+            key = (lane, client)
+            self._lane_vtime[lane] = self._client_start[key]
+            self._client_finish[key] = self._client_start[key] + ticket.cost
+            if queues[client]:
+                self._client_start[key] = self._client_finish[key]
+            else:
+                del queues[client]
+                del self._client_start[key]
+
+            ticket.started_at = time.monotonic()
+            self.running += 1
+            self.running_by_lane[lane] += 1
+            ticket.future.set_result(None)
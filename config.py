@@ -9,6 +9,24 @@ class Settings(BaseSettings):
     use_kimi_api: bool = False   # 👈 add this line
     upload_dir: str = "data/uploads"
     processed_dir: str = "data/processed"
+    memory_budget_mb: int | None = None    # cap on rasterized pages; default: half the container limit
+    memory_budget_wait_seconds: float = 30  # how long /process waits for room
+    web_concurrency: int = 1                # worker processes (gunicorn/uvicorn WEB_CONCURRENCY)
+    ocr_mode: str = "full"                  # "full" or "coarse_to_fine"
+    ocr_coarse_dpi: int = 150               # first-pass DPI in coarse_to_fine mode
+    ocr_refine_confidence: float = 0.85     # blocks below this are re-read at full DPI
+    ocr_cache_enabled: bool = True          # reuse OCR results for identical pages
+    ocr_cache_entries: int = 2048           # in-memory LRU size (pages, per worker)
+    ocr_cache_dir: str | None = None        # shared disk tier, off unless set (e.g. data/ocr_cache)
+    ocr_cache_disk_mb: int = 512            # disk tier size cap; least recently used pages go first
+    ocr_cache_ttl_hours: float = 168        # entries expire this long after first cached; 0 keeps them
+    scheduler_concurrency: int = 2          # documents processed at once per worker (min 2)
+    scheduler_lane_weights: dict[str, float] = {"interactive": 4, "bulk": 1}
+    interactive_max_pages: int = 3          # larger documents go to the bulk lane
+    client_id_header: str = "X-API-Key"     # fair-share key; falls back to client IP
+    llm_small_model: str | None = None      # override the cheap tier's model
+    llm_large_model: str | None = None      # override the expensive tier's model
+    document_type_tiers: dict[str, str] = {}  # e.g. {"invoice": "small"}
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,55 @@
+# Multi-worker deployment: gunicorn -c gunicorn.conf.py backend.main:app
+#
+# Workers are shared-nothing: each one imports the app after fork and builds
+# its own DB connection pool, LLM client and memory budget share. Metrics are
+# written to PROMETHEUS_MULTIPROC_DIR and merged by whichever worker serves /metrics.
+import math, os, shutil
+
+
+def usable_cpus() -> int:
+    """CPUs this container may actually use: the affinity mask, capped by a
+    cgroup v2 CPU quota (cpu_count() reports the host's cores)."""
+    cpus = len(os.sched_getaffinity(0))
+    try:
+        quota, period = open("/sys/fs/cgroup/cpu.max").read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+
+# One worker per core is the sweet spot: OCR is CPU-bound, so more workers than
+# cores just contend. Override with WEB_CONCURRENCY (the Cloud Run deploy sets it).
+workers = int(os.getenv("WEB_CONCURRENCY") or usable_cpus())
+os.environ["WEB_CONCURRENCY"] = str(workers)  # so settings.web_concurrency matches
+
+worker_class = "uvicorn.workers.UvicornWorker"
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+timeout = 300  # long OCR jobs on big PDFs
+accesslog = "-"
+
+# Must be set before any worker imports prometheus_client
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/smartdoc-metrics")
+
+
+def on_starting(server):
+    # Start from a clean metrics dir so values from a previous run don't linger
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+    # Create tables once here rather than racing in every worker; backend.main
+    # skips its own create_all when this flag is set
+    from backend.db.database import engine, add_missing_columns
+    from backend.db import models
+    models.Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine)
+    engine.dispose()
+    os.environ["SMARTDOC_SCHEMA_READY"] = "1"
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (active_processing, memory budget)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)